@@ -4,33 +4,77 @@ CSS Signage Agent - Flask REST API Server
 Provides endpoints for managing the Raspberry Pi signage display
 """
 
-from flask import Flask, jsonify, request, send_from_directory, redirect, send_file, after_this_request
-from werkzeug.utils import secure_filename
+from flask import Flask, Request, Response, jsonify, request, redirect
+from flask.json.provider import DefaultJSONProvider
 import subprocess
 import psutil
 import os
 import json
 import time
 import socket
-from datetime import datetime
+import io
+import re
+import hashlib
+import shutil
+import signal
 import tempfile
+import threading
+import pwd
+import functools
+import uuid
+import queue
+import atexit
+from datetime import datetime
 import glob as globmod
 
+try:
+    import orjson  # optional: much faster JSON encoding on the Pi
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes responses and parses request bodies with orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+
+class UploadRequest(Request):
+    """Request that spools large uploaded files inside UPLOAD_FOLDER, so saving
+    them (see save_upload) is a hard link instead of a second full copy"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= 500 * 1024:
+            # Small uploads stay in memory, same as werkzeug's default
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        return tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_FOLDER, prefix='.upload-')
+
 app = Flask(__name__, static_folder='static')
 app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024  # 20 MB upload limit
+app.request_class = UploadRequest
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 PLAYLIST_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads', 'playlist')
 MAX_PLAYLIST_IMAGES = 20
-ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+ALLOWED_IMAGE_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'})
+
+def file_extension(filename):
+    """Return the lower-cased extension of a filename without the dot, or ''"""
+    _, dot, ext = filename.rpartition('.')
+    return ext.lower() if dot else ''
 CONFIG_FILE = '/etc/css/config.json'
 FULLPAGEOS_CONFIG = '/boot/firmware/fullpageos.txt'
+# Screenshots go to tmpfs when available so captures never touch the SD card
+SCREENSHOT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
 
 # ===== STARTUP CLEANUP =====
 # Clear caches and temp files every time the service starts
 def startup_cleanup():
     """Clean up disk-filling files on every startup"""
-    import glob
     cleaned = []
 
     # 1. Chromium cache (biggest offender)
@@ -45,19 +89,26 @@ def startup_cleanup():
         '/root/.config/chromium/*/Cache/*',
         '/root/.config/chromium/*/Code Cache/*',
     ]:
-        for f in glob.glob(pattern):
+        for f in globmod.glob(pattern):
             try:
                 if os.path.isfile(f):
                     os.unlink(f)
                 elif os.path.isdir(f):
-                    import shutil
                     shutil.rmtree(f, ignore_errors=True)
                 cleaned.append(f)
             except:
                 pass
 
-    # 2. Old screenshots in /tmp
-    for f in glob.glob('/tmp/css-screenshot-*'):
+    # 2. Old screenshots (older versions used /tmp)
+    for f in globmod.glob('/tmp/css-screenshot-*') + globmod.glob(os.path.join(SCREENSHOT_DIR, 'css-screenshot-*')):
+        try:
+            os.unlink(f)
+            cleaned.append(f)
+        except:
+            pass
+
+    # Upload spool files left behind by a crash mid-upload
+    for f in globmod.glob(os.path.join(UPLOAD_FOLDER, '**', '.upload-*'), recursive=True):
         try:
             os.unlink(f)
             cleaned.append(f)
@@ -65,7 +116,7 @@ def startup_cleanup():
             pass
 
     # 3. General temp files older than 1 day
-    for f in glob.glob('/tmp/*.log'):
+    for f in globmod.glob('/tmp/*.log'):
         try:
             if os.path.isfile(f) and (time.time() - os.path.getmtime(f)) > 86400:
                 os.unlink(f)
@@ -105,10 +156,9 @@ def startup_cleanup():
             pass
 
     # 7. Delete rotated/compressed log files (including Xorg.0.log.old)
-    import glob as glob_mod
     for pattern in ['/var/log/*.gz', '/var/log/*.1', '/var/log/*.2', '/var/log/*.old',
                     '/var/log/**/*.gz', '/var/log/**/*.1', '/var/log/**/*.old']:
-        for f in glob_mod.glob(pattern, recursive=True):
+        for f in globmod.glob(pattern, recursive=True):
             try:
                 os.unlink(f)
                 cleaned.append(f)
@@ -120,20 +170,106 @@ def startup_cleanup():
 
 startup_cleanup()
 
+NO_CACHE_HEADERS = (
+    ('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0'),
+)
+
+class HealthCheckMiddleware:
+    """Answer GET /api/health before Flask routing - it's polled constantly
+    and needs none of the request/response machinery."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        # (second, body, headers) - the timestamp only needs one-second resolution
+        self.cached = (None, None, None)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == '/api/health' and environ.get('REQUEST_METHOD') == 'GET':
+            now = int(time.time())
+            second, body, headers = self.cached
+            if second != now:
+                body = ('{"status":"healthy","timestamp":"%s"}\n'
+                        % datetime.fromtimestamp(now).isoformat()).encode()
+                headers = [
+                    ('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(body))),
+                    *NO_CACHE_HEADERS,
+                ]
+                self.cached = (now, body, headers)
+            start_response('200 OK', list(headers))
+            return [body]
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = HealthCheckMiddleware(app.wsgi_app)
+
+# Endpoints whose responses carry an ETag: the browser may keep them but must revalidate.
+# 'static' covers uploaded images - Flask's static handler already answers 304s.
+REVALIDATE_ENDPOINTS = {'waiting', 'offline', 'static'}
+
 # Disable caching for all responses
 @app.after_request
 def add_no_cache_headers(response):
     """Add headers to prevent caching"""
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    if request.endpoint in REVALIDATE_ENDPOINTS:
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    response.headers.update(NO_CACHE_HEADERS)
     return response
 
+def try_stat(path):
+    """os.stat() that returns None instead of raising for a missing file"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def atomic_write(path, data):
+    """Write a text file so a power cut leaves either the old or the new version, never a truncated one"""
+    # Unique temp file per call - handler threads and the network monitor may write the same path at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # Keep the existing file's permissions (the installer makes some world-writable)
+            shutil.copymode(path, tmp_path)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)  # mkstemp creates files private to us
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+# Parsed config keyed on the file's mtime, so repeated reads skip the JSON parse
+# Stored as one (mtime, data) tuple so a load and a save can never pair the wrong halves
+_config_cache = {'entry': (None, None)}
+# Held around every load -> modify -> save so concurrent requests don't overwrite each other
+_config_lock = threading.RLock()
+
 def load_config():
-    """Load configuration from file"""
+    """Load configuration from file (cached until the file changes)"""
+    return load_config_with_mtime()[0]
+
+def load_config_with_mtime():
+    """Load configuration and return (config, mtime_ns); mtime is None when the file is missing"""
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
+        with _config_lock:
+            mtime = os.stat(CONFIG_FILE).st_mtime_ns
+            cached_mtime, data = _config_cache['entry']
+            if mtime != cached_mtime:
+                with open(CONFIG_FILE, 'rb') as f:
+                    raw = f.read()
+                data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+                _config_cache['entry'] = (mtime, data)
+        # Shallow copy so callers can modify their config without touching the cache
+        return dict(data), mtime
     except FileNotFoundError:
         # Return default config if file doesn't exist
         return {
@@ -141,31 +277,49 @@ def load_config():
             'room': '',
             'display_url': 'file:///opt/css-agent/static/waiting.html',
             'api_port': 5000
-        }
+        }, None
 
 def save_config(config):
-    """Save configuration to file"""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+    """Save configuration to file (skipped when nothing changed)"""
+    with _config_lock:
+        cached_mtime, cached_data = _config_cache['entry']
+        try:
+            if config == cached_data and os.stat(CONFIG_FILE).st_mtime_ns == cached_mtime:
+                return
+        except FileNotFoundError:
+            pass
+        if orjson is not None:
+            data = orjson.dumps(config, option=orjson.OPT_INDENT_2).decode('utf-8')
+        else:
+            data = json.dumps(config, indent=2)
+        atomic_write(CONFIG_FILE, data)
+        _config_cache['entry'] = (os.stat(CONFIG_FILE).st_mtime_ns, dict(config))
+    _last_status['time'] = None  # next /api/status must show the new config
 
-def get_playlist_config():
+def get_playlist_config(config=None):
     """Return playlist section of config with defaults"""
-    config = load_config()
+    if config is None:
+        config = load_config()
     return {
-        'images': config.get('playlist_images', []),
+        'images': list(config.get('playlist_images', [])),
         'display_time': config.get('playlist_display_time', 5),
         'fade_time': config.get('playlist_fade_time', 1),
         'fallback_enabled': config.get('playlist_fallback_enabled', False)
     }
 
-def save_playlist_config(playlist):
-    """Merge playlist settings back into main config"""
-    config = load_config()
-    config['playlist_images'] = playlist.get('images', [])
-    config['playlist_display_time'] = playlist.get('display_time', 5)
-    config['playlist_fade_time'] = playlist.get('fade_time', 1)
-    config['playlist_fallback_enabled'] = playlist.get('fallback_enabled', False)
-    save_config(config)
+def save_playlist_config(playlist, config=None):
+    """Merge playlist settings back into main config (loaded here unless passed in)"""
+    with _config_lock:
+        if config is None:
+            config = load_config()
+        config['playlist_images'] = playlist.get('images', [])
+        config['playlist_display_time'] = playlist.get('display_time', 5)
+        config['playlist_fade_time'] = playlist.get('fade_time', 1)
+        config['playlist_fallback_enabled'] = playlist.get('fallback_enabled', False)
+        save_config(config)
+    if config['playlist_images']:
+        # Render the slideshow now so the browser's next load is just a lookup
+        get_slideshow_html(config['playlist_images'], config['playlist_display_time'], config['playlist_fade_time'])
 
 def get_agent_version():
     """Read version from the repo's VERSION file"""
@@ -176,60 +330,213 @@ def get_agent_version():
     except Exception:
         return 'unknown'
 
+# Both update paths (/api/update and css-auto-update.service) restart the agent,
+# so the version can't change while this process is running
+AGENT_VERSION = get_agent_version()
+
+THERMAL_FILE = '/sys/class/thermal/thermal_zone0/temp'
+TEMP_CACHE_SECONDS = 2
+_temp_cache = {'time': None, 'value': None}
+
+# Keep the sysfs file open; reading at offset 0 makes the kernel produce a fresh value
+try:
+    _thermal_fd = os.open(THERMAL_FILE, os.O_RDONLY)
+except OSError:
+    _thermal_fd = None
+
 def get_cpu_temp():
-    """Get CPU temperature in Celsius"""
+    """Get CPU temperature in Celsius (re-read at most every TEMP_CACHE_SECONDS)"""
+    now = time.monotonic()
+    if _temp_cache['time'] is not None and now - _temp_cache['time'] < TEMP_CACHE_SECONDS:
+        return _temp_cache['value']
     try:
-        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-            temp = int(f.read().strip()) / 1000.0
-            return round(temp, 1)
+        if _thermal_fd is not None:
+            raw = os.pread(_thermal_fd, 16, 0)
+        else:
+            with open(THERMAL_FILE, 'rb') as f:
+                raw = f.read()
+        temp = round(int(raw) / 1000.0, 1)
+    except:
+        temp = None
+    _temp_cache['time'] = now
+    _temp_cache['value'] = temp
+    return temp
+
+def get_default_interface():
+    """Return the interface carrying the default route (lowest metric), or None"""
+    best = None
+    try:
+        with open('/proc/net/route', 'r') as f:
+            next(f)  # skip header
+            for line in f:
+                # Iface Destination Gateway Flags RefCnt Use Metric ...
+                fields = line.split()
+                if len(fields) < 7 or fields[1] != '00000000':
+                    continue
+                if not int(fields[3], 16) & 0x1:  # RTF_UP
+                    continue
+                metric = int(fields[6])
+                if best is None or metric < best[0]:
+                    best = (metric, fields[0])
     except:
         return None
+    return best[1] if best else None
+
+IP_CACHE_SECONDS = 30
+_ip_cache = {'time': None, 'value': None}
 
 def get_ip_address():
-    """Get the Pi's IP address"""
+    """Get the Pi's IP address (address of the default-route interface, cached)"""
+    now = time.monotonic()
+    if _ip_cache['time'] is not None and now - _ip_cache['time'] < IP_CACHE_SECONDS:
+        return _ip_cache['value']
+    ip = "Unknown"
     try:
-        # Connect to external address to determine local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
+        iface = get_default_interface()
+        if iface:
+            for addr in psutil.net_if_addrs().get(iface, []):
+                if addr.family == socket.AF_INET:
+                    ip = addr.address
+                    break
     except:
-        return "Unknown"
+        pass
+    _ip_cache['time'] = now
+    _ip_cache['value'] = ip
+    return ip
+
+def run_command(args, timeout, text=False, check=False):
+    """Run a command and capture its output, like subprocess.run.
+    On timeout the child gets SIGTERM first - sudo relays that to the real
+    command, whereas a SIGKILL to sudo would orphan it - then SIGKILL after 1 s."""
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.terminate()
+        try:
+            proc.communicate(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+        raise
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
 
 def restart_chromium():
     """Kill Chromium gracefully (FullPageOS will auto-restart it)"""
-    try:
-        subprocess.run(['pkill', 'chromium'], check=False, timeout=2)
-        time.sleep(1)
-    except:
-        subprocess.run(['pkill', '-9', 'chromium'], check=False)
+    procs = [p for p in psutil.process_iter(['name']) if 'chromium' in (p.info['name'] or '')]
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.Error:
+            pass  # already gone
+    # Wait up to 1 s, but return as soon as every process has exited.
+    # Stragglers are left to finish saving their profile rather than SIGKILLed.
+    psutil.wait_procs(procs, timeout=1)
+
+# Boot time can't change while we're running - read /proc/stat once
+BOOT_TIME = psutil.boot_time()
+
+# Latest system metrics, refreshed by start_metrics_sampler().
+# The sampler swaps in a whole new dict, so readers never see a half-updated one.
+METRICS_INTERVAL = 2  # seconds
+_metrics_stop = threading.Event()
+
+def sample_metrics():
+    """Take one reading of everything /api/status reports that changes over time"""
+    return {
+        'cpu_percent': psutil.cpu_percent(interval=None),  # usage since the previous sample
+        'memory_percent': psutil.virtual_memory().percent,
+        'temperature': get_cpu_temp(),
+        'ip_address': get_ip_address(),
+    }
+
+# No CPU interval to measure yet - report None until the sampler's first tick
+_metrics = dict(sample_metrics(), cpu_percent=None)
+
+def start_metrics_sampler():
+    """Sample system metrics in the background so /api/status only copies a dict"""
+    def _sample():
+        global _metrics
+        # Newer psutil keeps the cpu_percent baseline per thread, so prime it here
+        psutil.cpu_percent(interval=None)
+        while not _metrics_stop.wait(METRICS_INTERVAL):
+            try:
+                _metrics = sample_metrics()
+            except Exception as e:
+                print(f"⚠️ Metrics sampling failed: {e}")
+
+    threading.Thread(target=_sample, daemon=True).start()
+    atexit.register(_metrics_stop.set)
 
-def update_display_url(url):
-    """Write URL to FullPageOS config and restart browser"""
-    with open(FULLPAGEOS_CONFIG, 'w') as f:
-        f.write(url + '\n')
-    os.sync()
+def save_display_url(url):
+    """Save URL as the display URL in config.json"""
+    with _config_lock:
+        config = load_config()
+        config['display_url'] = url
+        save_config(config)
+
+def set_display_url(url):
+    """Save URL as the display URL, write it to FullPageOS config and restart browser"""
+    with _config_lock:
+        save_display_url(url)
+        atomic_write(FULLPAGEOS_CONFIG, url + '\n')
     restart_chromium()
 
+# Polls closer together than this get the previous status back
+STATUS_MIN_INTERVAL = 1.0
+_last_status = {'time': None, 'data': None}
+_status_lock = threading.Lock()
+
+def get_recent_status():
+    """Return the last built status if it is still fresh, else None"""
+    built = _last_status['time']
+    if built is not None and time.monotonic() - built < STATUS_MIN_INTERVAL:
+        return _last_status['data']
+    return None
+
+# Status fields that come from config.json, rebuilt only when the file changes
+_status_config_fields = {'mtime': None, 'fields': None}
+
+def get_status_config_fields():
+    """Return the config-derived part of the status payload"""
+    config, mtime = load_config_with_mtime()
+    if _status_config_fields['fields'] is None or mtime is None or mtime != _status_config_fields['mtime']:
+        _status_config_fields['fields'] = {
+            'name': config.get('name', 'Unknown'),
+            'room': config.get('room', ''),
+            'current_url': config.get('display_url', ''),
+            'version': AGENT_VERSION,
+            'screen_rotation': config.get('screen_rotation', 0),
+        }
+        _status_config_fields['mtime'] = mtime
+    return _status_config_fields['fields']
+
+def build_status():
+    """Collect the status payload from config and the latest metrics"""
+    status = dict(get_status_config_fields())
+    status.update(_metrics)
+    status['uptime'] = int(time.time() - BOOT_TIME)
+    status['timestamp'] = datetime.now().isoformat()
+    return status
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get current Pi status including stats and configuration"""
-    config = load_config()
-
-    return jsonify({
-        'name': config.get('name', 'Unknown'),
-        'room': config.get('room', ''),
-        'current_url': config.get('display_url', ''),
-        'version': get_agent_version(),
-        'uptime': int(time.time() - psutil.boot_time()),
-        'cpu_percent': psutil.cpu_percent(interval=1),
-        'memory_percent': psutil.virtual_memory().percent,
-        'temperature': get_cpu_temp(),
-        'ip_address': get_ip_address(),
-        'screen_rotation': config.get('screen_rotation', 0),
-        'timestamp': datetime.now().isoformat()
-    })
+    status = get_recent_status()
+    if status is None:
+        with _status_lock:
+            # Pollers that arrive together wait here and reuse the first one's result
+            status = get_recent_status()
+            if status is None:
+                status = build_status()
+                _last_status['data'] = status
+                _last_status['time'] = time.monotonic()
+    return jsonify(status)
+
+# Fields the dashboard may change through POST /api/config
+CONFIG_FIELDS = ('name', 'room', 'display_url', 'api_port')
 
 @app.route('/api/config', methods=['GET', 'POST'])
 def config():
@@ -238,20 +545,17 @@ def config():
         return jsonify(load_config())
     else:
         # Update configuration
-        data = request.json
-        config = load_config()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
 
-        # Update only provided fields
-        if 'name' in data:
-            config['name'] = data['name']
-        if 'room' in data:
-            config['room'] = data['room']
-        if 'display_url' in data:
-            config['display_url'] = data['display_url']
-        if 'api_port' in data:
-            config['api_port'] = data['api_port']
+        with _config_lock:
+            config = load_config()
 
-        save_config(config)
+            # Update only provided fields
+            config.update((key, data[key]) for key in CONFIG_FIELDS if key in data)
+
+            save_config(config)
         return jsonify({'success': True, 'message': 'Configuration updated'})
 
 @app.route('/api/display/url', methods=['POST'])
@@ -264,14 +568,9 @@ def set_url():
 
     url = data['url']
 
-    # Update configuration
-    config = load_config()
-    config['display_url'] = url
-    save_config(config)
-
-    # Update FullPageOS config and restart browser
+    # Update configuration and FullPageOS config, then restart browser
     try:
-        update_display_url(url)
+        set_display_url(url)
         return jsonify({'success': True, 'message': f'URL changed to {url}'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -281,6 +580,7 @@ def restart_browser():
     """Restart the Chromium browser"""
     try:
         restart_chromium()
+        _chromium_user_cache['time'] = None  # look the user up again next time
         return jsonify({'success': True, 'message': 'Browser restarted'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -290,8 +590,7 @@ def get_screenshot():
     """Capture screenshot of current display"""
     try:
         # Use a simple temporary path that the X user can write to
-        import time
-        screenshot_path = f'/tmp/css-screenshot-{int(time.time())}.png'
+        screenshot_path = os.path.join(SCREENSHOT_DIR, f'css-screenshot-{int(time.time())}.png')
 
         # Try multiple screenshot methods until one works
         result = None
@@ -300,10 +599,10 @@ def get_screenshot():
         # Method 1: scrot with explicit env vars (no wrapper script, no $HOME dependency)
         xauthority = f'/home/{user}/.Xauthority'
         try:
-            result = subprocess.run(
+            result = run_command(
                 ['sudo', '-u', user, 'env', 'DISPLAY=:0', f'XAUTHORITY={xauthority}',
                  'scrot', screenshot_path],
-                capture_output=True, timeout=5
+                timeout=5
             )
         except Exception as e:
             print(f"⚠️ scrot attempt failed: {e}")
@@ -312,10 +611,7 @@ def get_screenshot():
         if result is None or result.returncode != 0:
             print("ℹ️ scrot failed, trying fbgrab (framebuffer)...")
             try:
-                result = subprocess.run(
-                    ['fbgrab', screenshot_path],
-                    capture_output=True, timeout=5
-                )
+                result = run_command(['fbgrab', screenshot_path], timeout=5)
             except Exception as e:
                 print(f"⚠️ fbgrab attempt failed: {e}")
 
@@ -323,10 +619,7 @@ def get_screenshot():
         if result is None or result.returncode != 0:
             print("ℹ️ fbgrab failed, trying scrot as root...")
             try:
-                result = subprocess.run(
-                    ['env', 'DISPLAY=:0', 'scrot', screenshot_path],
-                    capture_output=True, timeout=5
-                )
+                result = run_command(['env', 'DISPLAY=:0', 'scrot', screenshot_path], timeout=5)
             except Exception as e:
                 print(f"⚠️ scrot-as-root attempt failed: {e}")
 
@@ -339,6 +632,11 @@ def get_screenshot():
                 os.unlink(screenshot_path)
             return jsonify({'success': False, 'error': f'Screenshot capture failed: {error_msg}'}), 500
 
+        # Read the capture into memory and remove the temp file right away
+        with open(screenshot_path, 'rb') as f:
+            png_data = f.read()
+        os.unlink(screenshot_path)
+
         # Apply rotation to match what the display actually shows
         # fbgrab captures the raw framebuffer which doesn't include xrandr rotation
         try:
@@ -346,32 +644,27 @@ def get_screenshot():
             rotation = config.get('screen_rotation', 0)
             if rotation and rotation != 0:
                 from PIL import Image
-                img = Image.open(screenshot_path)
                 # PIL rotate is counter-clockwise, xrandr rotation is CW
                 # rotation 90 (right) = rotate image 270° CCW = 90° CW
                 # rotation 180 (inverted) = rotate 180°
                 # rotation 270 (left) = rotate image 90° CCW = 270° CW
-                pil_degrees = {90: 270, 180: 180, 270: 90}.get(rotation, 0)
-                if pil_degrees:
-                    img = img.rotate(pil_degrees, expand=True)
-                    img.save(screenshot_path)
+                # transpose() moves pixels losslessly - much cheaper than rotate(expand=True)
+                transpose_op = {90: Image.Transpose.ROTATE_270,
+                                180: Image.Transpose.ROTATE_180,
+                                270: Image.Transpose.ROTATE_90}.get(rotation)
+                if transpose_op is not None:
+                    img = Image.open(io.BytesIO(png_data)).transpose(transpose_op)
+                    buf = io.BytesIO()
+                    # Fastest zlib level - encode time matters more than size for a preview
+                    img.save(buf, 'PNG', compress_level=1)
+                    png_data = buf.getvalue()
         except ImportError:
             print("⚠️ Pillow not installed, screenshot may not match display rotation")
         except Exception as e:
             print(f"⚠️ Could not rotate screenshot: {e}")
 
-        # Send file with callback to cleanup after sending
-        @after_this_request
-        def cleanup(response):
-            try:
-                if os.path.exists(screenshot_path):
-                    os.unlink(screenshot_path)
-            except:
-                pass
-            return response
-
-        return send_file(screenshot_path, mimetype='image/png', as_attachment=True,
-                        download_name='screenshot.png', max_age=0)
+        return Response(png_data, mimetype='image/png',
+                        headers={'Content-Disposition': 'attachment; filename=screenshot.png'})
 
     except subprocess.TimeoutExpired:
         if os.path.exists(screenshot_path):
@@ -384,6 +677,17 @@ def get_screenshot():
             os.unlink(screenshot_path)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# xrandr output line for an active output, e.g. "HDMI-1 connected primary 1920x1080+0+0 ..."
+XRANDR_CONNECTED_RE = re.compile(r'^(\S+) connected\b', re.MULTILINE)
+# Clockwise rotation in degrees -> xrandr --rotate value
+XRANDR_ROTATIONS = {0: 'normal', 90: 'right', 180: 'inverted', 270: 'left'}
+
+def get_connected_display(user):
+    """Return the first connected xrandr output (HDMI-1, HDMI-2, etc.), or None"""
+    result = run_command(['sudo', '-u', user, 'env', 'DISPLAY=:0', 'xrandr'], timeout=5, text=True)
+    match = XRANDR_CONNECTED_RE.search(result.stdout)
+    return match.group(1) if match else None
+
 @app.route('/api/display/rotate', methods=['POST'])
 def rotate_display():
     """Rotate the display orientation"""
@@ -400,37 +704,24 @@ def rotate_display():
         # Use xrandr to rotate the display via X11
         user = get_chromium_user()
 
-        # Detect primary display (run as the X user)
-        result = subprocess.run(
-            ['sudo', '-u', user, 'env', 'DISPLAY=:0', 'xrandr'],
-            capture_output=True,
-            text=True
-        )
-
         # Find connected display (HDMI-1, HDMI-2, etc.)
-        display_name = None
-        for line in result.stdout.split('\n'):
-            if 'connected primary' in line or 'connected' in line:
-                display_name = line.split()[0]
-                if 'connected' in line:
-                    break
-
+        display_name = get_connected_display(user)
         if not display_name:
             return jsonify({'success': False, 'error': 'Could not detect display'}), 500
 
-        rotation_map = {0: 'normal', 90: 'right', 180: 'inverted', 270: 'left'}
-        xrandr_rotation = rotation_map[rotation]
+        xrandr_rotation = XRANDR_ROTATIONS[rotation]
 
         # Apply rotation using xrandr (run as the X user)
-        subprocess.run(
+        run_command(
             ['sudo', '-u', user, 'env', 'DISPLAY=:0', 'xrandr', '--output', display_name, '--rotate', xrandr_rotation],
-            check=True
+            timeout=5, check=True
         )
 
         # Save rotation to config so screenshot can apply it
-        config = load_config()
-        config['screen_rotation'] = rotation
-        save_config(config)
+        with _config_lock:
+            config = load_config()
+            config['screen_rotation'] = rotation
+            save_config(config)
 
         return jsonify({
             'success': True,
@@ -462,14 +753,8 @@ def update():
         # Fetch latest, then hard reset to origin/main
         # This avoids "local changes would be overwritten" errors on Pis that
         # were modified directly (e.g. install script edits on the device).
-        subprocess.run(git + ['fetch', 'origin', 'main'],
-                       capture_output=True, text=True, timeout=30)
-        result = subprocess.run(
-            git + ['reset', '--hard', 'origin/main'],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+        run_command(git + ['fetch', 'origin', 'main'], timeout=30, text=True)
+        result = run_command(git + ['reset', '--hard', 'origin/main'], timeout=30, text=True)
 
         success = result.returncode == 0
         output = result.stdout + result.stderr
@@ -478,7 +763,6 @@ def update():
             # Kill this process after sending the response.
             # systemd's Restart=always will bring it back up with the new code.
             # No sudo or permission changes needed.
-            import signal, threading
             threading.Timer(2, lambda: os.kill(os.getpid(), signal.SIGTERM)).start()
 
         return jsonify({
@@ -491,6 +775,12 @@ def update():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Every contiguous subnet mask ('255.255.255.0' -> '24'); anything else is counted bit by bit
+NETMASK_PREFIXES = {
+    socket.inet_ntoa(((0xffffffff << (32 - n)) & 0xffffffff).to_bytes(4, 'big')): str(n)
+    for n in range(33)
+}
+
 def netmask_to_cidr(netmask):
     """Convert subnet mask (255.255.255.0) to CIDR prefix length (24)"""
     try:
@@ -502,33 +792,23 @@ def netmask_to_cidr(netmask):
         pass
     # Convert dotted notation to CIDR
     try:
+        prefix = NETMASK_PREFIXES.get(netmask)
+        if prefix is not None:
+            return prefix
         return str(sum(bin(int(x)).count('1') for x in netmask.split('.')))
     except:
         return '24'  # fallback
 
 def detect_active_interface():
     """Detect the active network interface (eth0, wlan0, etc.)"""
-    try:
-        result = subprocess.run(
-            ['ip', 'route', 'get', '8.8.8.8'],
-            capture_output=True, text=True, timeout=5
-        )
-        # Output like: "8.8.8.8 via 192.168.1.1 dev eth0 src 192.168.1.100"
-        for part in result.stdout.split():
-            if part == 'dev':
-                idx = result.stdout.split().index('dev')
-                return result.stdout.split()[idx + 1]
-    except:
-        pass
-    return 'eth0'  # fallback
+    # The interface holding the default route is the one `ip route get 8.8.8.8`
+    # would report - read it from /proc instead of forking ip
+    return get_default_interface() or 'eth0'  # fallback
 
+@functools.lru_cache(maxsize=1)
 def has_nmcli():
-    """Check if NetworkManager (nmcli) is available"""
-    try:
-        result = subprocess.run(['which', 'nmcli'], capture_output=True)
-        return result.returncode == 0
-    except:
-        return False
+    """Check if NetworkManager (nmcli) is available (won't change while we run)"""
+    return shutil.which('nmcli') is not None
 
 @app.route('/api/network/ip', methods=['POST'])
 def configure_network():
@@ -592,8 +872,7 @@ def configure_network():
             # Fallback: dhcpcd (older Raspberry Pi OS)
             if mode == 'dhcp':
                 dhcpcd_config = "# Generated by CSS Agent\n# DHCP configuration\n"
-                with open('/etc/dhcpcd.conf', 'w') as f:
-                    f.write(dhcpcd_config)
+                atomic_write('/etc/dhcpcd.conf', dhcpcd_config)
                 new_ip = "DHCP"
             else:
                 if not all(k in data for k in ['ip', 'netmask', 'gateway']):
@@ -614,17 +893,16 @@ static ip_address={ip}/{cidr}
 static routers={gateway}
 static domain_name_servers={dns}
 """
-                with open('/etc/dhcpcd.conf', 'w') as f:
-                    f.write(dhcpcd_config)
+                atomic_write('/etc/dhcpcd.conf', dhcpcd_config)
+
+        # Don't report the old address from cache
+        _ip_cache['time'] = None
 
         # Switch display to waiting page so the new IP is shown after reboot
-        config = load_config()
-        config['display_url'] = 'http://localhost:5000/waiting'
-        save_config(config)
+        # (browser is left alone - the change takes effect on the reboot)
+        save_display_url('http://localhost:5000/waiting')
         try:
-            with open(FULLPAGEOS_CONFIG, 'w') as f:
-                f.write('http://localhost:5000/waiting\n')
-            os.sync()
+            atomic_write(FULLPAGEOS_CONFIG, 'http://localhost:5000/waiting\n')
         except:
             pass
 
@@ -649,18 +927,18 @@ static domain_name_servers={dns}
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def is_timer_enabled(timer):
+    """Check if a systemd timer is enabled without forking systemctl.
+    Enabling a timer (WantedBy=timers.target) links it into timers.target.wants."""
+    return os.path.lexists(os.path.join('/etc/systemd/system/timers.target.wants', timer))
+
 @app.route('/api/settings/autoupdate', methods=['GET', 'POST'])
 def autoupdate_settings():
     """Get or configure auto-update settings"""
     if request.method == 'GET':
         try:
             # Check if auto-update timer is enabled
-            result = subprocess.run(
-                ['systemctl', 'is-enabled', 'css-auto-update.timer'],
-                capture_output=True,
-                text=True
-            )
-            enabled = result.returncode == 0
+            enabled = is_timer_enabled('css-auto-update.timer')
 
             return jsonify({
                 'enabled': enabled,
@@ -676,12 +954,10 @@ def autoupdate_settings():
 
         try:
             if data['enabled']:
-                subprocess.run(['systemctl', 'enable', 'css-auto-update.timer'], check=True)
-                subprocess.run(['systemctl', 'start', 'css-auto-update.timer'], check=True)
+                subprocess.run(['systemctl', 'enable', '--now', 'css-auto-update.timer'], check=True)
                 message = 'Auto-update enabled'
             else:
-                subprocess.run(['systemctl', 'stop', 'css-auto-update.timer'], check=True)
-                subprocess.run(['systemctl', 'disable', 'css-auto-update.timer'], check=True)
+                subprocess.run(['systemctl', 'disable', '--now', 'css-auto-update.timer'], check=True)
                 message = 'Auto-update disabled'
 
             return jsonify({'success': True, 'message': message})
@@ -694,12 +970,7 @@ def reboot_settings():
     if request.method == 'GET':
         try:
             # Check if daily reboot timer is enabled
-            result = subprocess.run(
-                ['systemctl', 'is-enabled', 'css-daily-reboot.timer'],
-                capture_output=True,
-                text=True
-            )
-            enabled = result.returncode == 0
+            enabled = is_timer_enabled('css-daily-reboot.timer')
 
             return jsonify({
                 'enabled': enabled,
@@ -715,7 +986,6 @@ def reboot_settings():
 
         try:
             # Re-copy timer/service files from repo in case they were updated
-            import shutil
             agent_dir = os.path.dirname(os.path.abspath(__file__))
             for f in ['css-daily-reboot.timer', 'css-daily-reboot.service']:
                 src = os.path.join(agent_dir, 'systemd', f)
@@ -724,12 +994,10 @@ def reboot_settings():
             subprocess.run(['systemctl', 'daemon-reload'], check=True)
 
             if data['enabled']:
-                subprocess.run(['systemctl', 'enable', 'css-daily-reboot.timer'], check=True)
-                subprocess.run(['systemctl', 'start', 'css-daily-reboot.timer'], check=True)
+                subprocess.run(['systemctl', 'enable', '--now', 'css-daily-reboot.timer'], check=True)
                 message = 'Daily reboot enabled'
             else:
-                subprocess.run(['systemctl', 'stop', 'css-daily-reboot.timer'], check=True)
-                subprocess.run(['systemctl', 'disable', 'css-daily-reboot.timer'], check=True)
+                subprocess.run(['systemctl', 'disable', '--now', 'css-daily-reboot.timer'], check=True)
                 message = 'Daily reboot disabled'
 
             return jsonify({'success': True, 'message': message})
@@ -750,6 +1018,19 @@ def configure_browser_flags():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def save_upload(file, filepath):
+    """Save an uploaded file, hard-linking UploadRequest's spool file into place when possible"""
+    spool_path = getattr(file.stream, 'name', None)
+    if isinstance(spool_path, str) and os.path.dirname(spool_path).startswith(UPLOAD_FOLDER):
+        try:
+            file.stream.flush()
+            os.chmod(spool_path, 0o644)  # temp files are created private
+            os.link(spool_path, filepath)
+            return
+        except OSError:
+            pass  # e.g. destination already exists - fall back to copying
+    file.save(filepath)
+
 @app.route('/api/display/image', methods=['POST'])
 def upload_image():
     """Upload an image to display on the Pi"""
@@ -761,45 +1042,68 @@ def upload_image():
         return jsonify({'success': False, 'error': 'No file selected'}), 400
 
     # Validate extension
-    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    ext = file_extension(file.filename)
     if ext not in ALLOWED_IMAGE_EXTENSIONS:
-        return jsonify({'success': False, 'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_IMAGE_EXTENSIONS)}'}), 400
+        return jsonify({'success': False, 'error': f'Invalid file type. Allowed: {", ".join(sorted(ALLOWED_IMAGE_EXTENSIONS))}'}), 400
 
     try:
         # Ensure upload directory exists
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-        # Remove any existing display images
-        for old_file in globmod.glob(os.path.join(UPLOAD_FOLDER, 'display-image.*')):
-            os.unlink(old_file)
+        with _display_image_lock:
+            # Remove any existing display images
+            _display_image_cache['valid'] = False
+            for entry in scan_display_images():
+                os.unlink(entry.path)
 
-        # Save the new image
-        filename = f'display-image.{ext}'
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-
-        # Update display URL to show the image
-        image_url = 'http://localhost:5000/api/display/image/view'
-        config = load_config()
-        config['display_url'] = image_url
-        save_config(config)
+            # Save the new image
+            filename = f'display-image.{ext}'
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            save_upload(file, filepath)
+            _display_image_cache.update(valid=True, filename=filename)
 
-        # Update FullPageOS config and restart browser
-        update_display_url(image_url)
+        # Update display URL to show the image and restart browser
+        set_display_url('http://localhost:5000/api/display/image/view')
 
         return jsonify({'success': True, 'message': 'Image uploaded and displaying', 'filename': filename})
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/display/image/view', methods=['GET'])
-def view_image():
-    """Serve a fullscreen HTML page displaying the uploaded image"""
-    # Find the current display image
-    for ext in ALLOWED_IMAGE_EXTENSIONS:
-        filepath = os.path.join(UPLOAD_FOLDER, f'display-image.{ext}')
-        if os.path.exists(filepath):
-            return f'''<!DOCTYPE html>
+def scan_display_images():
+    """List display-image.* entries in the uploads folder with one directory read"""
+    try:
+        with os.scandir(UPLOAD_FOLDER) as it:
+            return [entry for entry in it if entry.name.startswith('display-image.')]
+    except FileNotFoundError:
+        return []
+
+# Last answer of find_display_image() - only upload_image/delete_image change it
+_display_image_cache = {'valid': False, 'filename': None}
+# Held from invalidate to record, so a scan can't cache a half-replaced folder
+_display_image_lock = threading.Lock()
+
+def find_display_image():
+    """Return the filename of the uploaded display image, or None"""
+    with _display_image_lock:
+        if _display_image_cache['valid']:
+            return _display_image_cache['filename']
+        found = None
+        for entry in scan_display_images():
+            if entry.name.rpartition('.')[2] in ALLOWED_IMAGE_EXTENSIONS:
+                found = entry.name
+                break
+        _display_image_cache.update(valid=True, filename=found)
+        return found
+
+def forget_display_image():
+    """Drop the cached filename after finding the file gone from disk"""
+    with _display_image_lock:
+        _display_image_cache['valid'] = False
+
+def render_view_html(filename):
+    """Return the fullscreen HTML page (as bytes) for an uploaded image"""
+    return f'''<!DOCTYPE html>
 <html>
 <head>
 <meta charset="UTF-8">
@@ -823,24 +1127,43 @@ img {{
 </style>
 </head>
 <body>
-<img src="/static/uploads/display-image.{ext}" alt="">
+<img src="/static/uploads/{filename}" alt="">
 </body>
-</html>''', 200, {'Content-Type': 'text/html'}
+</html>'''.encode('utf-8')
+
+# The view page only differs by the image's extension, so render every variant up front
+VIEW_HTML = {
+    f'display-image.{ext}': render_view_html(f'display-image.{ext}')
+    for ext in ALLOWED_IMAGE_EXTENSIONS
+}
+
+@app.route('/api/display/image/view', methods=['GET'])
+def view_image():
+    """Serve a fullscreen HTML page displaying the uploaded image"""
+    filename = find_display_image()
+    if filename:
+        # The file may have been removed outside the API
+        if os.path.isfile(os.path.join(UPLOAD_FOLDER, filename)):
+            return Response(VIEW_HTML[filename], mimetype='text/html')
+        forget_display_image()
 
     return jsonify({'success': False, 'error': 'No image uploaded'}), 404
 
 @app.route('/api/display/image/current', methods=['GET'])
 def get_current_image():
     """Get metadata about the currently uploaded image"""
-    for ext in ALLOWED_IMAGE_EXTENSIONS:
-        filepath = os.path.join(UPLOAD_FOLDER, f'display-image.{ext}')
-        if os.path.exists(filepath):
-            size = os.path.getsize(filepath)
+    filename = find_display_image()
+    if filename:
+        try:
+            size = os.path.getsize(os.path.join(UPLOAD_FOLDER, filename))
             return jsonify({
                 'has_image': True,
-                'filename': f'display-image.{ext}',
+                'filename': filename,
                 'size_bytes': size
             })
+        except OSError:
+            # Removed outside the API - rescan next time
+            forget_display_image()
 
     return jsonify({'has_image': False})
 
@@ -849,9 +1172,12 @@ def delete_image():
     """Delete the currently uploaded image"""
     try:
         deleted = False
-        for old_file in globmod.glob(os.path.join(UPLOAD_FOLDER, 'display-image.*')):
-            os.unlink(old_file)
-            deleted = True
+        with _display_image_lock:
+            _display_image_cache['valid'] = False
+            for entry in scan_display_images():
+                os.unlink(entry.path)
+                deleted = True
+            _display_image_cache.update(valid=True, filename=None)
 
         if deleted:
             return jsonify({'success': True, 'message': 'Image deleted'})
@@ -860,6 +1186,30 @@ def delete_image():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Files waiting to be deleted by the background remover thread
+_remove_queue = queue.SimpleQueue()
+_remover_thread = {'thread': None}
+_remover_lock = threading.Lock()
+
+def remove_file_later(path):
+    """Delete a file in the background - unlinking big images on the SD card can stall"""
+    _remove_queue.put(path)
+    with _remover_lock:
+        if _remover_thread['thread'] is None:
+            _remover_thread['thread'] = threading.Thread(target=_remove_files, daemon=True)
+            _remover_thread['thread'].start()
+
+def _remove_files():
+    """Background loop behind remove_file_later()"""
+    while True:
+        path = _remove_queue.get()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Warning: could not delete file {path}: {e}')
+
 @app.route('/api/display/playlist', methods=['GET', 'POST', 'DELETE'])
 def playlist_api():
     """GET: return playlist config. POST: update settings. DELETE: clear all images."""
@@ -867,28 +1217,28 @@ def playlist_api():
         return jsonify(get_playlist_config())
 
     if request.method == 'DELETE':
-        playlist = get_playlist_config()
-        for filename in playlist['images']:
-            filepath = os.path.join(PLAYLIST_FOLDER, filename)
-            try:
-                if os.path.exists(filepath):
-                    os.unlink(filepath)
-            except Exception as e:
-                print(f'Warning: could not delete {filepath}: {e}')
-        playlist['images'] = []
-        save_playlist_config(playlist)
+        with _config_lock:
+            config = load_config()
+            playlist = get_playlist_config(config)
+            filenames = playlist['images']
+            playlist['images'] = []
+            save_playlist_config(playlist, config)
+        for filename in filenames:
+            remove_file_later(os.path.join(PLAYLIST_FOLDER, filename))
         return jsonify({'success': True})
 
     # POST — update settings
     data = request.json or {}
-    playlist = get_playlist_config()
-    if 'display_time' in data:
-        playlist['display_time'] = max(1, int(data['display_time']))
-    if 'fade_time' in data:
-        playlist['fade_time'] = max(0, float(data['fade_time']))
-    if 'fallback_enabled' in data:
-        playlist['fallback_enabled'] = bool(data['fallback_enabled'])
-    save_playlist_config(playlist)
+    with _config_lock:
+        config = load_config()
+        playlist = get_playlist_config(config)
+        if 'display_time' in data:
+            playlist['display_time'] = max(1, int(data['display_time']))
+        if 'fade_time' in data:
+            playlist['fade_time'] = max(0, float(data['fade_time']))
+        if 'fallback_enabled' in data:
+            playlist['fallback_enabled'] = bool(data['fallback_enabled'])
+        save_playlist_config(playlist, config)
     return jsonify({'success': True, 'playlist': playlist})
 
 
@@ -899,23 +1249,29 @@ def upload_playlist_image():
         return jsonify({'success': False, 'error': 'No image file provided'}), 400
 
     file = request.files['image']
-    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    ext = file_extension(file.filename)
     if ext not in ALLOWED_IMAGE_EXTENSIONS:
         return jsonify({'success': False, 'error': 'Invalid file type'}), 400
 
-    playlist = get_playlist_config()
-    if len(playlist['images']) >= MAX_PLAYLIST_IMAGES:
-        return jsonify({'success': False, 'error': f'Maximum {MAX_PLAYLIST_IMAGES} images reached'}), 400
+    with _config_lock:
+        config = load_config()
+        playlist = get_playlist_config(config)
+        if len(playlist['images']) >= MAX_PLAYLIST_IMAGES:
+            return jsonify({'success': False, 'error': f'Maximum {MAX_PLAYLIST_IMAGES} images reached'}), 400
 
-    os.makedirs(PLAYLIST_FOLDER, exist_ok=True)
+        os.makedirs(PLAYLIST_FOLDER, exist_ok=True)
 
-    index = len(playlist['images'])
-    filename = f'playlist-{index}.{ext}'
-    filepath = os.path.join(PLAYLIST_FOLDER, filename)
-    file.save(filepath)
+        # Names must never be reused: after deleting from the middle of the list,
+        # naming by position would overwrite an image that's still in the playlist
+        index = len(playlist['images'])
+        serial = config.get('playlist_next_index', index)
+        filename = f'playlist-{serial}-{uuid.uuid4().hex[:6]}.{ext}'
+        filepath = os.path.join(PLAYLIST_FOLDER, filename)
+        save_upload(file, filepath)
 
-    playlist['images'].append(filename)
-    save_playlist_config(playlist)
+        playlist['images'].append(filename)
+        config['playlist_next_index'] = serial + 1
+        save_playlist_config(playlist, config)
 
     return jsonify({'success': True, 'index': index, 'filename': filename, 'total': len(playlist['images'])})
 
@@ -923,20 +1279,15 @@ def upload_playlist_image():
 @app.route('/api/display/playlist/images/<int:index>', methods=['DELETE'])
 def delete_playlist_image(index):
     """Remove one image from the playlist by index"""
-    playlist = get_playlist_config()
-    if index < 0 or index >= len(playlist['images']):
-        return jsonify({'success': False, 'error': 'Invalid index'}), 400
-
-    filename = playlist['images'][index]
-    filepath = os.path.join(PLAYLIST_FOLDER, filename)
-    try:
-        if os.path.exists(filepath):
-            os.unlink(filepath)
-    except Exception as e:
-        print(f'Warning: could not delete file {filepath}: {e}')
+    with _config_lock:
+        config = load_config()
+        playlist = get_playlist_config(config)
+        if index < 0 or index >= len(playlist['images']):
+            return jsonify({'success': False, 'error': 'Invalid index'}), 400
 
-    playlist['images'].pop(index)
-    save_playlist_config(playlist)
+        filename = playlist['images'].pop(index)
+        save_playlist_config(playlist, config)
+    remove_file_later(os.path.join(PLAYLIST_FOLDER, filename))
     return jsonify({'success': True, 'total': len(playlist['images'])})
 
 
@@ -947,79 +1298,93 @@ def activate_playlist():
     if not playlist['images']:
         return jsonify({'success': False, 'error': 'No images in playlist'}), 400
 
-    playlist_url = 'http://localhost:5000/slideshow'
-    config = load_config()
-    config['display_url'] = playlist_url
-    save_config(config)
     try:
-        update_display_url(playlist_url)
+        set_display_url('http://localhost:5000/slideshow')
         return jsonify({'success': True, 'message': 'Slideshow activated'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/slideshow', methods=['GET'])
-def slideshow():
-    """Serve a self-contained image playlist slideshow page"""
-    playlist = get_playlist_config()
-    images = playlist['images']
-    display_time = playlist['display_time']
-    fade_time = playlist['fade_time']
-
-    if not images:
-        return '''<!DOCTYPE html><html><body style="background:#000;color:#fff;display:flex;
+EMPTY_SLIDESHOW_HTML = b'''<!DOCTYPE html><html><body style="background:#000;color:#fff;display:flex;
 align-items:center;justify-content:center;height:100vh;font-family:sans-serif;font-size:24px;">
-<p>No images in playlist</p></body></html>''', 200, {'Content-Type': 'text/html'}
+<p>No images in playlist</p></body></html>'''
 
-    slides_html = '\n'.join(
-        f'<div class="slide" id="slide{i}"><img src="/static/uploads/playlist/{img}" alt=""></div>'
-        for i, img in enumerate(images)
-    )
-    display_ms = int(display_time * 1000)
-    interval_ms = int((display_time + fade_time) * 1000)
+# (playlist signature, rendered page) - swapped as one tuple so threads never mix them up
+_slideshow_cache = {'entry': (None, None)}
 
-    return f'''<!DOCTYPE html>
+# Slideshow page around the slides; filled in with %-formatting (hence the %%)
+SLIDESHOW_HEAD = b'''<!DOCTYPE html>
 <html>
 <head>
 <meta charset="UTF-8">
 <meta name="google" content="notranslate">
 <style>
-* {{ margin: 0; padding: 0; box-sizing: border-box; }}
-body {{ background: #000; width: 100vw; height: 100vh; overflow: hidden; position: relative; }}
-.slide {{
-    position: absolute; top: 0; left: 0; width: 100%; height: 100%;
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body { background: #000; width: 100vw; height: 100vh; overflow: hidden; position: relative; }
+.slide {
+    position: absolute; top: 0; left: 0; width: 100%%; height: 100%%;
     display: flex; align-items: center; justify-content: center;
     opacity: 0;
-    transition: opacity {fade_time}s ease-in-out;
-}}
-.slide.active {{ opacity: 1; }}
-img {{ max-width: 100vw; max-height: 100vh; object-fit: contain; }}
+    transition: opacity %bs ease-in-out;
+}
+.slide.active { opacity: 1; }
+img { max-width: 100vw; max-height: 100vh; object-fit: contain; }
 </style>
 </head>
 <body>
-{slides_html}
+'''
+SLIDE_HTML = b'<div class="slide" id="slide%d"><img src="/static/uploads/playlist/%b" alt=""></div>'
+SLIDESHOW_TAIL = b'''
 <script>
 var slides = document.querySelectorAll('.slide');
 var current = 0;
 var total = slides.length;
-function showSlide(n) {{
-    slides.forEach(function(s) {{ s.classList.remove('active'); }});
+function showSlide(n) {
+    slides.forEach(function(s) { s.classList.remove('active'); });
     slides[n].classList.add('active');
-}}
-function next() {{
-    current = (current + 1) % total;
+}
+function next() {
+    current = (current + 1) %% total;
     showSlide(current);
-}}
+}
 showSlide(0);
-setInterval(next, {interval_ms});
+setInterval(next, %d);
 </script>
 </body>
-</html>''', 200, {'Content-Type': 'text/html'}
+</html>'''
+
+def render_slideshow_html(images, display_time, fade_time):
+    """Return the slideshow page (as bytes) for a non-empty playlist"""
+    interval_ms = int((display_time + fade_time) * 1000)
+    slides_html = b'\n'.join([SLIDE_HTML % (i, img.encode('utf-8')) for i, img in enumerate(images)])
+    return b''.join((SLIDESHOW_HEAD % str(fade_time).encode('ascii'), slides_html, SLIDESHOW_TAIL % interval_ms))
+
+def get_slideshow_html(images, display_time, fade_time):
+    """Return the slideshow page for this playlist, rendering it only if it changed"""
+    key = (tuple(images), display_time, fade_time)
+    cached_key, html = _slideshow_cache['entry']
+    if cached_key != key:
+        html = render_slideshow_html(images, display_time, fade_time)
+        _slideshow_cache['entry'] = (key, html)
+    return html
+
+@app.route('/slideshow', methods=['GET'])
+def slideshow():
+    """Serve a self-contained image playlist slideshow page"""
+    playlist = get_playlist_config()
+    images = playlist['images']
+    display_time = playlist['display_time']
+    fade_time = playlist['fade_time']
+
+    if not images:
+        return Response(EMPTY_SLIDESHOW_HTML, mimetype='text/html')
+
+    return Response(get_slideshow_html(images, display_time, fade_time), mimetype='text/html')
 
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (GETs are answered by HealthCheckMiddleware)"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
 @app.route('/', methods=['GET'])
@@ -1027,15 +1392,32 @@ def index():
     """Root endpoint - redirect to waiting page"""
     return redirect('/waiting')
 
+def load_static_page(filename):
+    """Read a static HTML page into memory along with its ETag"""
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        body = f.read()
+    return body, hashlib.md5(body).hexdigest()
+
+# These pages only change with an update, which restarts the agent
+WAITING_PAGE = load_static_page('waiting.html')
+OFFLINE_PAGE = load_static_page('offline.html')
+
+def serve_static_page(page):
+    """Serve a preloaded page, answering 304 when the browser's copy is current"""
+    body, etag = page
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 @app.route('/waiting', methods=['GET'])
 def waiting():
     """Serve the waiting page"""
-    return send_from_directory('static', 'waiting.html')
+    return serve_static_page(WAITING_PAGE)
 
 @app.route('/offline', methods=['GET'])
 def offline():
     """Serve the offline page"""
-    return send_from_directory('static', 'offline.html')
+    return serve_static_page(OFFLINE_PAGE)
 
 @app.route('/api/info', methods=['GET'])
 def info():
@@ -1048,23 +1430,55 @@ def info():
         'status': 'running'
     })
 
+# The X/Chromium user doesn't change while the kiosk runs; re-check every few minutes
+CHROMIUM_USER_CACHE_SECONDS = 300
+_chromium_user_cache = {'time': None, 'user': None}
+
+def find_process_user():
+    """Return the non-root user running Chromium, else the one running Xorg, else None"""
+    # Walk /proc directly: the owner of /proc/<pid> is the process's uid, so
+    # root processes (most of them) are skipped without opening anything.
+    xorg_uid = None
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            uid = os.stat(f'/proc/{pid}').st_uid
+            if uid == 0:
+                continue
+            with open(f'/proc/{pid}/comm', 'r') as f:
+                name = f.read().strip()
+        except OSError:
+            continue  # process exited while we looked
+        if 'chromium' in name:
+            return uid_to_name(uid)
+        if xorg_uid is None and name == 'Xorg':
+            xorg_uid = uid
+    return uid_to_name(xorg_uid) if xorg_uid is not None else None
+
+def uid_to_name(uid):
+    """Map a uid to its user name, or None if it has no passwd entry"""
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return None
+
 def get_chromium_user():
     """Detect which user is running Chromium / X session"""
+    now = time.monotonic()
+    cached_at = _chromium_user_cache['time']
+    if cached_at is not None and now - cached_at < CHROMIUM_USER_CACHE_SECONDS:
+        return _chromium_user_cache['user']
+
     try:
-        # Method 1: Check who's running Chromium
-        result = subprocess.run(['ps', 'aux'], capture_output=True, text=True)
-        for line in result.stdout.split('\n'):
-            if 'chromium' in line and 'chrome_crashpad_handler' not in line:
-                username = line.split()[0]
-                if username != 'root':
-                    return username
-
-        # Method 2: Check who's running Xorg
-        for line in result.stdout.split('\n'):
-            if 'Xorg' in line:
-                username = line.split()[0]
-                if username != 'root':
-                    return username
+        # Method 1+2: Check who's running Chromium, then Xorg.
+        # Only this answer is cached - the fallbacks below are guesses made
+        # before the X session is up, so keep looking on the next call.
+        user = find_process_user()
+        if user:
+            _chromium_user_cache['time'] = now
+            _chromium_user_cache['user'] = user
+            return user
 
         # Method 3: Check lightdm auto-login config
         if os.path.exists('/etc/lightdm/lightdm.conf'):
@@ -1079,112 +1493,177 @@ def get_chromium_user():
     except:
         return 'pi'
 
-def configure_chromium_preferences():
-    """Configure Chromium to disable translation via /etc/chromium.d/ and Preferences JSON"""
-    try:
-        user = get_chromium_user()
-
-        # ===== PART 1: /etc/chromium.d/ (the correct Debian/Raspberry Pi OS way) =====
-        # On Debian-based systems, /usr/bin/chromium-browser is a wrapper that sources
-        # all files in /etc/chromium.d/ and passes CHROMIUM_FLAGS to the real binary.
-        # This is the ONLY reliable way to pass flags on Raspberry Pi OS.
-        chromiumd_dir = '/etc/chromium.d'
-        chromiumd_file = os.path.join(chromiumd_dir, '99-css-disable-translate')
-        chromiumd_content = '# CSS Signage: Disable Chromium translate popup\nexport CHROMIUM_FLAGS="$CHROMIUM_FLAGS --disable-features=Translate,TranslateUI --disable-translate"\n'
-
-        # Also ensure cache limit flag file exists
-        cache_limit_file = os.path.join(chromiumd_dir, '50-css-cache-limit')
-        cache_limit_content = '# CSS Signage: Limit disk cache to 50MB to prevent SD card filling\nexport CHROMIUM_FLAGS="$CHROMIUM_FLAGS --disk-cache-size=52428800 --media-cache-size=52428800"\n'
-        if not os.path.exists(cache_limit_file):
-            with open(cache_limit_file, 'w') as f:
-                f.write(cache_limit_content)
-
-        os.makedirs(chromiumd_dir, exist_ok=True)
-        needs_update = True
-        if os.path.exists(chromiumd_file):
-            with open(chromiumd_file, 'r') as f:
-                if f.read() == chromiumd_content:
-                    needs_update = False
-
-        if needs_update:
-            with open(chromiumd_file, 'w') as f:
-                f.write(chromiumd_content)
-            print(f"✅ Created {chromiumd_file}")
-        else:
-            print(f"✅ {chromiumd_file} already configured")
-
-        # ===== PART 2: Patch FullPageOS launch script =====
-        # The start script has --disable-features=TranslateUI which overrides our flags.
-        # We must change it to --disable-features=Translate,TranslateUI in the script itself.
-        import glob as g
-        for pattern in [f'/home/{user}/scripts/start_chromium_browser',
-                        '/home/*/scripts/start_chromium_browser',
-                        '/opt/custompios/scripts/start_chromium_browser',
-                        '/opt/fullpageos/scripts/start_chromium_browser']:
-            for launch_script in g.glob(pattern):
-                if os.path.isfile(launch_script):
-                    with open(launch_script, 'r') as f:
-                        content = f.read()
-                    if '--disable-features=TranslateUI' in content and '--disable-features=Translate,TranslateUI' not in content:
-                        content = content.replace('--disable-features=TranslateUI',
-                                                  '--disable-features=Translate,TranslateUI')
-                        with open(launch_script, 'w') as f:
-                            f.write(content)
-                        print(f"✅ Patched launch script: {launch_script}")
-
-        # ===== PART 3: Modify Preferences JSON as defense in depth =====
-        prefs_dir = f'/home/{user}/.config/chromium/Default'
-        prefs_file = os.path.join(prefs_dir, 'Preferences')
-        if os.path.exists(prefs_file):
-            try:
-                with open(prefs_file, 'r') as f:
-                    prefs = json.load(f)
-
-                if 'translate' not in prefs or prefs.get('translate', {}).get('enabled') != False:
-                    if 'translate' not in prefs:
-                        prefs['translate'] = {}
-                    prefs['translate']['enabled'] = False
-
-                    with open(prefs_file, 'w') as f:
-                        json.dump(prefs, f, indent=2)
-
-                    import pwd
-                    uid = pwd.getpwnam(user).pw_uid
-                    gid = pwd.getpwnam(user).pw_gid
-                    os.chown(prefs_file, uid, gid)
+@functools.lru_cache(maxsize=8)
+def get_uid_gid(user):
+    """Return (uid, gid) for a user name - passwd entries don't change while we run"""
+    pw = pwd.getpwnam(user)
+    return pw.pw_uid, pw.pw_gid
+
+# (mtime, content) of files last seen to hold the content we want
+_verified_files = {}
+
+def write_if_changed(path, content):
+    """Write a small text file only when its content differs. Returns True if written.
+    A file already verified and untouched since (same mtime) isn't even re-read."""
+    st = try_stat(path)
+    data = content.encode('utf-8')
+    if st is not None:
+        if _verified_files.get(path) == (st.st_mtime_ns, content):
+            return False
+        if st.st_size == len(data):  # a different size can't be the same content
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    _verified_files[path] = (st.st_mtime_ns, content)
+                    return False
+    with open(path, 'wb') as f:
+        f.write(data)
+    _verified_files[path] = (os.stat(path).st_mtime_ns, content)
+    return True
+
+# On Debian-based systems, /usr/bin/chromium-browser is a wrapper that sources
+# all files in /etc/chromium.d/ and passes CHROMIUM_FLAGS to the real binary.
+# This is the ONLY reliable way to pass flags on Raspberry Pi OS.
+CHROMIUMD_DIR = '/etc/chromium.d'
+TRANSLATE_FLAGS_FILE = os.path.join(CHROMIUMD_DIR, '99-css-disable-translate')
+TRANSLATE_FLAGS = '# CSS Signage: Disable Chromium translate popup\nexport CHROMIUM_FLAGS="$CHROMIUM_FLAGS --disable-features=Translate,TranslateUI --disable-translate"\n'
+CACHE_LIMIT_FLAGS_FILE = os.path.join(CHROMIUMD_DIR, '50-css-cache-limit')
+CACHE_LIMIT_FLAGS = '# CSS Signage: Limit disk cache to 50MB to prevent SD card filling\nexport CHROMIUM_FLAGS="$CHROMIUM_FLAGS --disk-cache-size=52428800 --media-cache-size=52428800"\n'
+
+# Preferences path -> mtime when translate was last seen disabled in it
+_prefs_checked = {}
+# "translate": {"enabled": false - as Chromium (compact) or we (indented) write it
+PREFS_TRANSLATE_OFF_RE = re.compile(rb'"translate":\s*\{\s*"enabled":\s*false\b')
+
+def write_chromium_flags():
+    """Install our /etc/chromium.d flag snippets"""
+    os.makedirs(CHROMIUMD_DIR, exist_ok=True)
+    # Also ensure cache limit flag file exists
+    if try_stat(CACHE_LIMIT_FLAGS_FILE) is None:
+        with open(CACHE_LIMIT_FLAGS_FILE, 'w') as f:
+            f.write(CACHE_LIMIT_FLAGS)
+
+    if write_if_changed(TRANSLATE_FLAGS_FILE, TRANSLATE_FLAGS):
+        print(f"✅ Created {TRANSLATE_FLAGS_FILE}")
+    else:
+        print(f"✅ {TRANSLATE_FLAGS_FILE} already configured")
+
+def patch_launch_scripts(user):
+    """Make FullPageOS's start script disable Translate as well as TranslateUI"""
+    # The start script has --disable-features=TranslateUI which overrides our flags.
+    # We must change it to --disable-features=Translate,TranslateUI in the script itself.
+    user_script = f'/home/{user}/scripts/start_chromium_browser'
+    candidates = [user_script, '/opt/custompios/scripts/start_chromium_browser',
+                  '/opt/fullpageos/scripts/start_chromium_browser']
+    if not os.path.isfile(user_script):
+        # User detection may have fallen back to a guess - look in every home directory
+        candidates += globmod.glob('/home/*/scripts/start_chromium_browser')
+    for launch_script in dict.fromkeys(candidates):
+        if os.path.isfile(launch_script):
+            with open(launch_script, 'rb') as f:
+                content = f.read()
+            if b'--disable-features=TranslateUI' in content and b'--disable-features=Translate,TranslateUI' not in content:
+                content = content.replace(b'--disable-features=TranslateUI',
+                                          b'--disable-features=Translate,TranslateUI')
+                with open(launch_script, 'wb') as f:
+                    f.write(content)
+                print(f"✅ Patched launch script: {launch_script}")
+
+def disable_translate_in_preferences(user):
+    """Turn translate off in the Chromium profile's Preferences JSON (defense in depth)"""
+    prefs_dir = f'/home/{user}/.config/chromium/Default'
+    prefs_file = os.path.join(prefs_dir, 'Preferences')
+    st = try_stat(prefs_file)
+    if st is not None and _prefs_checked.get(prefs_file) == st.st_mtime_ns:
+        print("✅ Preferences JSON already has translate disabled")
+    elif st is not None:
+        try:
+            # One open for read, rewrite and chown - Chromium may touch the file meanwhile
+            with open(prefs_file, 'r+b') as f:
+                raw = f.read()
+                # Usually already disabled - spot that without parsing the whole file
+                needs_update = False
+                if not PREFS_TRANSLATE_OFF_RE.search(raw):
+                    prefs = orjson.loads(raw) if orjson is not None else json.loads(raw)
+                    needs_update = prefs.get('translate', {}).get('enabled') != False
+
+                if needs_update:
+                    prefs.setdefault('translate', {})['enabled'] = False
+
+                    if orjson is not None:
+                        raw = orjson.dumps(prefs, option=orjson.OPT_INDENT_2)
+                    else:
+                        raw = json.dumps(prefs, indent=2).encode('utf-8')
+                    f.seek(0)
+                    f.truncate()
+                    f.write(raw)
+                    f.flush()
+                    owner = get_uid_gid(user)
+                    if (st.st_uid, st.st_gid) != owner:
+                        os.fchown(f.fileno(), *owner)
+                    os.fsync(f.fileno())
 
                     print(f"✅ Translate disabled in Preferences JSON: {prefs_file}")
                 else:
-                    print(f"✅ Preferences JSON already has translate disabled")
+                    print("✅ Preferences JSON already has translate disabled")
+                _prefs_checked[prefs_file] = os.fstat(f.fileno()).st_mtime_ns
 
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"⚠️ Warning: Could not update Preferences JSON: {e}")
-        else:
-            print(f"ℹ️ Preferences file not found yet: {prefs_file}")
+        except (json.JSONDecodeError, Exception) as e:
+            print(f"⚠️ Warning: Could not update Preferences JSON: {e}")
+    else:
+        print(f"ℹ️ Preferences file not found yet: {prefs_file}")
 
+def configure_chromium_preferences():
+    """Configure Chromium to disable translation via /etc/chromium.d/ and Preferences JSON"""
+    try:
+        user = get_chromium_user()
+        write_chromium_flags()
+        patch_launch_scripts(user)
+        disable_translate_in_preferences(user)
     except Exception as e:
         print(f"⚠️ Warning: Could not configure Chromium: {e}")
 
+# DNS query (after the 2-byte ID) for the root zone's NS records - any answer means we're online
+DNS_PROBE_QUERY = b'\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00' + b'\x00\x00\x02\x00\x01'
+DNS_PROBE_TIMEOUT = 5  # seconds
+
+def dns_probe(sock, query_id):
+    """Send one DNS query on a connected UDP socket; True once the matching reply arrives"""
+    ident = query_id.to_bytes(2, 'big')
+    sock.send(ident + DNS_PROBE_QUERY)
+    deadline = time.monotonic() + DNS_PROBE_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        sock.settimeout(remaining)
+        if sock.recv(512)[:2] == ident:  # skip late replies to earlier probes
+            return True
+
 def start_network_monitor():
     """Monitor internet connectivity and show offline page when network is down.
     When the network comes back, restore the configured display URL."""
-    import threading
 
     def _monitor():
         offline_shown = False
+        sock = None
+        query_id = 0
         # Wait for server and browser to be ready before starting checks
         time.sleep(30)
 
         while True:
             try:
-                # Check internet by connecting to a reliable DNS server
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.settimeout(5)
-                s.connect(("8.8.8.8", 53))
-                s.close()
-                online = True
-            except (socket.error, OSError):
+                # Check internet by asking a reliable DNS server something
+                if sock is None:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.connect(("8.8.8.8", 53))
+                query_id = (query_id + 1) & 0xffff
+                online = dns_probe(sock, query_id)
+            except OSError:
                 online = False
+            if not online and sock is not None:
+                # Start over with a fresh socket - the route or our address may have changed
+                sock.close()
+                sock = None
 
             if not online and not offline_shown:
                 # Network just went down - check if playlist fallback is enabled
@@ -1196,9 +1675,7 @@ def start_network_monitor():
                     else:
                         fallback_url = 'http://localhost:5000/offline'
                         print("Network down - showing offline page")
-                    with open(FULLPAGEOS_CONFIG, 'w') as f:
-                        f.write(fallback_url + '\n')
-                    os.sync()
+                    atomic_write(FULLPAGEOS_CONFIG, fallback_url + '\n')
                     restart_chromium()
                     offline_shown = True
                 except Exception as e:
@@ -1213,9 +1690,7 @@ def start_network_monitor():
                     # Don't restore if the configured URL is the offline page itself
                     if 'offline' in url:
                         url = 'http://localhost:5000/waiting'
-                    with open(FULLPAGEOS_CONFIG, 'w') as f:
-                        f.write(url + '\n')
-                    os.sync()
+                    atomic_write(FULLPAGEOS_CONFIG, url + '\n')
                     restart_chromium()
                     offline_shown = False
                 except Exception as e:
@@ -1228,40 +1703,31 @@ def start_network_monitor():
 def apply_saved_rotation():
     """Apply saved screen rotation on startup (runs in background thread).
     Retries because X/Chromium may not be ready yet at boot."""
-    import threading
     config = load_config()
     rotation = config.get('screen_rotation', 0)
     if not rotation or rotation == 0:
         return
 
-    rotation_map = {90: 'right', 180: 'inverted', 270: 'left'}
-    xrandr_rotation = rotation_map.get(rotation)
+    xrandr_rotation = XRANDR_ROTATIONS.get(rotation)
     if not xrandr_rotation:
         return
 
     def _apply():
+        display_name = None
         for attempt in range(20):
             time.sleep(5)
             try:
+                # Cached once Chromium/X is found; until then this is a guess, so ask each time
                 user = get_chromium_user()
 
-                # Get display name
-                result = subprocess.run(
-                    ['sudo', '-u', user, 'env', 'DISPLAY=:0', 'xrandr'],
-                    capture_output=True, text=True, timeout=5
-                )
-
-                display_name = None
-                for line in result.stdout.split('\n'):
-                    if 'connected' in line:
-                        display_name = line.split()[0]
-                        break
-
+                # Outputs don't change while we retry - only probe until one is found
+                if not display_name:
+                    display_name = get_connected_display(user)
                 if display_name:
-                    subprocess.run(
+                    run_command(
                         ['sudo', '-u', user, 'env', 'DISPLAY=:0', 'xrandr',
                          '--output', display_name, '--rotate', xrandr_rotation],
-                        check=True, timeout=5
+                        timeout=5, check=True
                     )
                     print(f"✅ Applied saved rotation: {rotation}°")
                     return
@@ -1272,6 +1738,14 @@ def apply_saved_rotation():
 
     threading.Thread(target=_apply, daemon=True).start()
 
+RESOLUTION_CONF = '''Section "Screen"
+  Identifier "HDMI-1"
+  SubSection "Display"
+    Modes "1920x1080"
+  EndSubSection
+EndSection
+'''
+
 def ensure_display_resolution():
     """Ensure display is set to 1920x1080 by creating X11 config if missing"""
     xorg_dir = '/usr/share/X11/xorg.conf.d'
@@ -1281,12 +1755,7 @@ def ensure_display_resolution():
         try:
             os.makedirs(xorg_dir, exist_ok=True)
             with open(conf_file, 'w') as f:
-                f.write('Section "Screen"\n')
-                f.write('  Identifier "HDMI-1"\n')
-                f.write('  SubSection "Display"\n')
-                f.write('    Modes "1920x1080"\n')
-                f.write('  EndSubSection\n')
-                f.write('EndSection\n')
+                f.write(RESOLUTION_CONF)
             print("✅ Created X11 resolution config (1920x1080)")
         except Exception as e:
             print(f"⚠️ Could not create resolution config: {e}")
@@ -1294,24 +1763,39 @@ def ensure_display_resolution():
         print("✅ X11 resolution config already exists")
 
 if __name__ == '__main__':
-    # Configure Chromium to disable translation (flags + Preferences JSON)
-    configure_chromium_preferences()
+    # Configure Chromium to disable translation (flags + Preferences JSON).
+    # Only touches files Chromium reads on its next start, so don't hold up the API for it
+    threading.Thread(target=configure_chromium_preferences, daemon=True).start()
     ensure_display_resolution()
 
-    # Load port from config
+    # Load port and worker thread count from config
     config = load_config()
     port = config.get('api_port', 5000)
+    # Screenshots and xrandr calls can hold a thread for seconds - leave room for status polls
+    threads = config.get('api_threads', 8)
 
     print(f"Starting CSS Signage Agent API server on port {port}")
     print(f"Pi Name: {config.get('name', 'Unknown')}")
     print(f"Display URL: {config.get('display_url', 'Not set')}")
 
+    # Sample CPU/memory/temperature/IP in background so /api/status returns instantly
+    start_metrics_sampler()
+
     # Apply saved rotation in background (doesn't block server startup)
     apply_saved_rotation()
 
     # Start network monitor to show offline page when internet is down
     start_network_monitor()
 
-    # Run Flask server
+    # Run the API server
     # host='0.0.0.0' allows external connections
-    app.run(host='0.0.0.0', port=port, debug=False)
+    try:
+        from waitress import serve  # production WSGI server, if installed
+    except ImportError:
+        serve = None
+
+    if serve is not None:
+        serve(app, host='0.0.0.0', port=port, threads=threads)
+    else:
+        # threaded=True so a slow handler (screenshot, update) doesn't stall other requests
+        app.run(host='0.0.0.0', port=port, debug=False, threaded=True)